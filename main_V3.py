@@ -1,11 +1,28 @@
 import os
+import re
+import atexit
+import argparse
+import mmap
 import shutil
+import struct
 import zipfile
 import py7zr
 import rarfile
+import time
 import tempfile
-from PIL import Image
+import threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
 from datetime import datetime
+from enum import IntEnum
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 
 COUNTS = {
@@ -20,9 +37,90 @@ COUNTS = {
     "TotalFiles": 0
 }
 
-LOG_PATH = None
+# Index into a thread's counters; names match the COUNTS keys
+class Count(IntEnum):
+    Character = 0
+    Clothing = 1
+    Scene = 2
+    Mod = 3
+    Extra = 4
+    Archives = 5
+    Errors = 6
+    Unknown = 7
+    TotalFiles = 8
+
+# Every thread counts into its own list; merge_counts folds them into COUNTS
+THREAD_COUNTS = threading.local()
+ALL_THREAD_COUNTS = []
+ALL_THREAD_COUNTS_LOCK = threading.Lock()
+
+# Per-file work is mostly file I/O, which releases the GIL.
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Archive extraction is CPU-bound decompression, so it gets a process per core.
+# Each scan_archives call (one per nesting level) also keeps at most this many
+# extractions in flight; a parent's temp folder stays until its nested
+# archives are done, so deeper nesting can hold more temp folders at once.
+# Windows refuses a process pool of more than 61 workers.
+EXTRACT_WORKERS = min(61, os.cpu_count() or 1)
+
+# Names in use per destination folder: what was there when unique_path first
+# saw the folder, plus every name it has handed out since (maybe not written yet)
+USED_NAMES = {}
+USED_NAMES_LOCK = threading.Lock()
+
+# Opened once per session and kept open; buffered so log lines don't each hit the disk
+LOG_FILE = None
+LOG_LOCK = threading.Lock()
+
+# Timestamp of the last log line; strftime only reruns when the second changes
+LAST_LOG_SECOND = None
+LAST_LOG_TIMESTAMP = ""
+
+# Files smaller than this are read outright; mapping them costs more than it saves.
+MMAP_MIN_SIZE = 4096
+
+# Card markers and the signal each one counts towards
+MARKER_SIGNALS = {
+    b"KoiKatuScene": "scene",
+    b"KoikatuScene": "scene",
+    b"<constraints": "scene_xml",
+    b"<itemInfo": "scene_xml",
+    b"KoiKatuClothes": "clothes",
+    b"KoiKatuChara": "chara",
+    b"KoikatuChara": "chara",
+}
+CARD_MARKERS = list(MARKER_SIGNALS)
+
+# Points for the 1st, 2nd, ... time a signal is seen; later sightings add
+# nothing. A second character header means a scene holding characters.
+SIGNAL_POINTS = {
+    "scene": [("Scene", 4)],
+    "scene_xml": [("Scene", 3)],
+    "clothes": [("Clothing", 4)],
+    "chara": [("Character", 3), ("Scene", 4)],
+}
+
+# Without hyperscan the markers are grouped so each family is one re scan.
+# Every pattern in a family shares a literal prefix, which keeps re on its fast
+# prefix search; a single alternation over all markers scans far slower.
+# Exactly the KoiKatu*/Koikatu* keys of MARKER_SIGNALS (there's no
+# "KoikatuClothes"), still behind the shared "Koi" prefix.
+KOIKATU_MARKERS = re.compile(rb"Koi(?:KatuClothes|[Kk]atu(?:Scene|Chara))")
+SCENE_XML_MARKERS = re.compile(rb"<(?:constraints|itemInfo)")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
 SORTED_ROOT = None
+# SORTED_ROOT plus a separator, so "sorted_files_backup" doesn't count as inside it
+SORTED_PREFIX = None
+
+# "copy"; "link" to hardlink into the sorted folders, or "move" to rename files
+# into them, where the filesystem allows it. Otherwise files are copied.
+COPY_MODE = "copy"
+
+# (source folder, destination folder) -> whether both are on one filesystem
+SAME_DEVICE = {}
 
 
 # ==================================================
@@ -38,18 +136,27 @@ def create_log_file(sorted_files_dir):
         f"sort_log_{timestamp}.txt"
     )
 
-    with open(log_path, "w", encoding="utf-8") as f:
-        f.write("=== Koikatsu Sort Session ===\n")
+    log_file = open(log_path, "w", encoding="utf-8", buffering=1 << 16)
+    log_file.write("=== Koikatsu Sort Session ===\n")
+    atexit.register(log_file.close)
 
-    return log_path
+    return log_file
 
 def log_message(message):
-    if LOG_PATH is None:
+    global LAST_LOG_SECOND, LAST_LOG_TIMESTAMP
+
+    if LOG_FILE is None:
         return
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {message}\n")
+    with LOG_LOCK:
+        second = int(time.time())
+        if second != LAST_LOG_SECOND:
+            LAST_LOG_TIMESTAMP = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(second)
+            )
+            LAST_LOG_SECOND = second
+
+        LOG_FILE.write(f"[{LAST_LOG_TIMESTAMP}] {message}\n")
 
 
 # ==================================================
@@ -75,107 +182,375 @@ def setup_sorted_folders(base_dir):
 def unique_path(folder, filename):
     name, ext = os.path.splitext(filename)
     counter = 1
-    dest = os.path.join(folder, filename)
+    candidate = filename
+
+    # Workers copy concurrently, so a name is taken as soon as it's handed out
+    with USED_NAMES_LOCK:
+        used = USED_NAMES.get(folder)
+        if used is None:
+            try:
+                used = {os.path.normcase(n) for n in os.listdir(folder)}
+            except FileNotFoundError:
+                used = set()
+            USED_NAMES[folder] = used
+
+        while os.path.normcase(candidate) in used:
+            candidate = f"{name}({counter}){ext}"
+            counter += 1
+        used.add(os.path.normcase(candidate))
+
+    return os.path.join(folder, candidate)
+
+def same_device(src, dest):
+    key = (os.path.dirname(src), os.path.dirname(dest))
+    same = SAME_DEVICE.get(key)
+    if same is None:
+        try:
+            same = os.stat(key[0]).st_dev == os.stat(key[1]).st_dev
+        except OSError:
+            same = False
+        SAME_DEVICE[key] = same
+    return same
+
+def place_file(src, dest):
+    if COPY_MODE == "move" and same_device(src, dest):
+        try:
+            os.replace(src, dest)
+            return dest
+        except OSError:
+            pass  # e.g. source is read-only or in use; leave it and copy
 
-    while os.path.exists(dest):
-        dest = os.path.join(folder, f"{name}({counter}){ext}")
-        counter += 1
+    if COPY_MODE == "link":
+        try:
+            os.link(src, dest)
+            return dest
+        except OSError:
+            pass  # other filesystem, or links unsupported
 
+    shutil.copyfile(src, dest)
+    shutil.copystat(src, dest)
     return dest
 
+def add_counts(*keys):
+    counts = getattr(THREAD_COUNTS, "counts", None)
+    if counts is None:
+        counts = THREAD_COUNTS.counts = [0] * len(Count)
+        with ALL_THREAD_COUNTS_LOCK:
+            ALL_THREAD_COUNTS.append(counts)
+
+    for key in keys:
+        counts[key] += 1
+
+# Call once no worker is counting any more
+def merge_counts():
+    with ALL_THREAD_COUNTS_LOCK:
+        for counts in ALL_THREAD_COUNTS:
+            for key in Count:
+                COUNTS[key.name] += counts[key]
+            counts[:] = [0] * len(Count)
+
 
 # ==================================================
 # DETECT CARD TYPE
 # ==================================================
 
-def detect_koikatsu_card_type(path):
-    width = height = None
+# Koikatsu appends its data after the image, so only the bytes around the
+# compressed pixel stream (the IDAT run) need scanning. Anything that doesn't
+# parse as a PNG is scanned whole.
+def card_scan_ranges(data):
+    size = len(data)
+    if data[:8] != PNG_SIGNATURE:
+        return [(0, size)]
+
+    pos = 8
+    idat_start = idat_end = None
+    while pos + 8 <= size:
+        length, chunk_type = struct.unpack_from(">I4s", data, pos)
+        chunk_end = pos + 12 + length
+
+        if chunk_type == b"IDAT":
+            if idat_start is None:
+                idat_start = pos
+            idat_end = chunk_end
+        elif idat_start is not None:
+            break  # IDAT chunks are consecutive, the pixel stream is over
+
+        pos = chunk_end
+
+    if idat_start is None or idat_end > size:
+        return [(0, size)]
+
+    return [(0, idat_start), (idat_end, size)]
+
+def png_size(data):
+    if len(data) < 24 or data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+        return None, None
+    return struct.unpack_from(">II", data, 16)
+
+# With hyperscan installed, all markers are matched in one pass of a compiled
+# literal database. Returns None when it's missing or the database won't build.
+def build_marker_database():
+    if hyperscan is None:
+        return None
+
     try:
-        with Image.open(path) as img:
-            width, height = img.size
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[re.escape(m) for m in CARD_MARKERS],
+            ids=list(range(len(CARD_MARKERS))),
+            elements=len(CARD_MARKERS),
+            flags=0
+        )
+        if not marker_database_works(db):
+            return None
+        return db
     except Exception:
-        pass
+        return None
+
+# Checked at start-up rather than trusted: the scan must take memoryview
+# slices, find what the re path finds, and stop when the handler says so.
+def marker_database_works(db):
+    sample = b" ".join(CARD_MARKERS + [b"KoikatuClothes"])
+    expected = [m.group() for m in KOIKATU_MARKERS.finditer(sample)]
+    expected += [m.group() for m in SCENE_XML_MARKERS.finditer(sample)]
+
+    found = []
+    with memoryview(sample) as view:
+        db.scan(
+            view[0:],
+            match_event_handler=lambda marker_id, *_: found.append(CARD_MARKERS[marker_id])
+        )
+    if sorted(found) != sorted(expected):
+        return False
 
+    stopped = []
     try:
-        with open(path, "rb") as f:
-            data = f.read()
-    except Exception:
-        return "Unknown"
+        db.scan(sample, match_event_handler=lambda *_: stopped.append(1) or True)
+    except hyperscan.ScanTerminated:
+        pass
+    return len(stopped) == 1
 
-    score = {
-        "Scene": 0,
-        "Character": 0,
-        "Clothing": 0
-    }
+MARKER_DATABASE = build_marker_database()
+
+# Hyperscan scratch space can't be shared by threads scanning at once
+MARKER_SCRATCH = threading.local()
 
-    if b"KoiKatuScene" in data or b"KoikatuScene" in data:
-        score["Scene"] += 4
+# Calls on_marker for each marker found; scanning stops once it returns True
+def scan_markers(data, ranges, on_marker):
+    if MARKER_DATABASE is not None:
+        scratch = getattr(MARKER_SCRATCH, "scratch", None)
+        if scratch is None:
+            scratch = MARKER_SCRATCH.scratch = hyperscan.Scratch(MARKER_DATABASE)
 
-    if b"<constraints" in data or b"<itemInfo" in data:
-        score["Scene"] += 3
+        def on_match(marker_id, start, end, flags, context):
+            return on_marker(CARD_MARKERS[marker_id])
 
-    if b"KoiKatuClothes" in data:
-        score["Clothing"] += 4
+        try:
+            with memoryview(data) as view:
+                for start, end in ranges:
+                    MARKER_DATABASE.scan(
+                        view[start:end],
+                        match_event_handler=on_match,
+                        scratch=scratch
+                    )
+        except hyperscan.ScanTerminated:
+            pass
+        return
 
-    if b"KoiKatuChara" in data or b"KoikatuChara" in data:
-        score["Character"] += 3
+    for start, end in ranges:
+        for m in KOIKATU_MARKERS.finditer(data, start, end):
+            if on_marker(m.group()):
+                return
 
-    chara_count = (
-        data.count(b"KoiKatuChara") +
-        data.count(b"KoikatuChara")
-    )
+    # Only whether the XML tags occur matters, so stop at the first one
+    for start, end in ranges:
+        m = SCENE_XML_MARKERS.search(data, start, end)
+        if m:
+            on_marker(m.group())
+            return
+
+# True once no marker still unseen could change which type wins. Ties go to
+# the type listed first in score, as with max().
+def card_type_settled(score, seen):
+    remaining = dict.fromkeys(score, 0)
+    for signal, points in SIGNAL_POINTS.items():
+        for card_type, value in points[seen[signal]:]:
+            remaining[card_type] += value
+
+    leader = max(score, key=score.get)
+    before_leader = True
+    for card_type in score:
+        if card_type == leader:
+            before_leader = False
+            continue
 
-    if chara_count >= 2:
-        score["Scene"] += 4
+        best = score[card_type] + remaining[card_type]
+        if best > score[leader] or (best == score[leader] and before_leader):
+            return False
 
+    return True
+
+def detect_koikatsu_card_type_from_bytes(data, filename):
+    score = {
+        "Scene": 0,
+        "Character": 0,
+        "Clothing": 0
+    }
+
+    # Fixed hints first, so the marker scan can stop as soon as it's decided
+    width, height = png_size(data)
     if width is not None and height is not None:
         if (width, height) == (320, 180):
             score["Scene"] += 3
         if (width, height) in [(252, 352), (252, 353), (504, 704)]:
             score["Character"] += 1
 
-    filename = os.path.basename(path).upper()
-    if filename.startswith("KKSCENE_"):
+    if filename.upper().startswith("KKSCENE_"):
         score["Scene"] += 1
 
+    seen = Counter()
+
+    def on_marker(marker):
+        signal = MARKER_SIGNALS[marker]
+        points = SIGNAL_POINTS[signal]
+        if seen[signal] >= len(points):
+            return False
+
+        card_type, value = points[seen[signal]]
+        score[card_type] += value
+        seen[signal] += 1
+        return card_type_settled(score, seen)
+
+    scan_markers(data, card_scan_ranges(data), on_marker)
+
     card_type = max(score, key=score.get)
     if score[card_type] == 0:
         return "Unknown"
 
     return card_type
 
+def detect_koikatsu_card_type(path):
+    filename = os.path.basename(path)
+
+    # Only a file that can't be read is Unknown; errors in scoring are bugs
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return "Unknown"
+
+    with f:
+        try:
+            if os.fstat(f.fileno()).st_size < MMAP_MIN_SIZE:
+                data = f.read()
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return "Unknown"
+
+        try:
+            return detect_koikatsu_card_type_from_bytes(data, filename)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+# A mod zip holds exactly abdata/ and manifest.xml at its top level
+MOD_ZIP_TOP_LEVEL = {"abdata", "manifest.xml"}
+
 def is_pure_mod_zip(zip_path):
     try:
         with zipfile.ZipFile(zip_path) as z:
             top_level = set()
 
-            for name in z.namelist():
-                parts = name.strip("/").split("/", 1)
-                if parts:
-                    top_level.add(parts[0].lower())
+            # Stop at the first entry outside the mod layout
+            for info in z.infolist():
+                top = info.filename.strip("/").split("/", 1)[0].lower()
+                if top not in MOD_ZIP_TOP_LEVEL:
+                    return False
+                top_level.add(top)
 
-            return top_level == {"abdata", "manifest.xml"}
+            return top_level == MOD_ZIP_TOP_LEVEL
     except Exception:
         return False
     
+# Zip members that can be classified straight from memory: the PNGs the temp
+# folder scan would treat as cards. Nothing is taken from beside or below a
+# BepInEx folder, since those are kept as they are. Pure mod zips never get here.
+def streamable_png_members(zip_path):
+    with zipfile.ZipFile(zip_path) as z:
+        names = z.namelist()
+
+    bepinex_parents = set()
+    pngs = []
+
+    for name in names:
+        is_dir = name.endswith("/")
+        parts = name.strip("/").lower().split("/")
+        folders = parts if is_dir else parts[:-1]
+
+        for i, part in enumerate(folders):
+            if part == "bepinex":
+                bepinex_parents.add(tuple(folders[:i]))
+
+        if not is_dir and os.path.splitext(parts[-1])[1] == ".png":
+            pngs.append((name, parts))
+
+    return {
+        name
+        for name, parts in pngs
+        if not any(tuple(parts[:i]) in bepinex_parents for i in range(len(parts)))
+    }
+
+# read() checks each member's CRC, so a corrupt one fails the whole archive
+# here, before any of its cards are written
+def classify_zip_pngs(zip_path, members):
+    with zipfile.ZipFile(zip_path) as z:
+        return [
+            (name, detect_koikatsu_card_type_from_bytes(
+                z.read(name), os.path.basename(name)
+            ))
+            for name in sorted(members)
+        ]
+
+# Names are reserved here in member order, so they don't depend on which copy
+# finishes first; the copies themselves run on the thread pool
+def write_zip_cards(zip_path, cards, output_dirs, executor):
+    with zipfile.ZipFile(zip_path) as z:
+        futures = [
+            executor.submit(
+                write_zip_card, z, name, card_type,
+                unique_path(card_folder(card_type, output_dirs), os.path.basename(name))
+            )
+            for name, card_type in cards
+        ]
+
+        # Let every copy finish before the zip closes, then raise any failure
+        wait(futures)
+        for future in futures:
+            future.result()
+
+def write_zip_card(z, name, card_type, dest):
+    with z.open(name) as src, open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+    add_counts(Count[card_type], Count.TotalFiles)
+
 def copy_folder_contents(src_dir, dest_dir):
     os.makedirs(dest_dir, exist_ok=True)
 
-    for item in os.listdir(src_dir):
-        src = os.path.join(src_dir, item)
-        dest = os.path.join(dest_dir, item)
+    with os.scandir(src_dir) as it:
+        for entry in it:
+            dest = os.path.join(dest_dir, entry.name)
 
-        if os.path.isdir(src):
-            shutil.copytree(src, dest, dirs_exist_ok=True)
-        else:
-            shutil.copy2(src, dest)
+            if entry.is_dir():
+                shutil.copytree(entry.path, dest, dirs_exist_ok=True)
+            else:
+                shutil.copy2(entry.path, dest)
 
 def find_bepinex_dir(root):
-    for entry in os.listdir(root):
-        if entry.lower() == "bepinex":
-            full = os.path.join(root, entry)
-            if os.path.isdir(full):
-                return full
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.name.lower() == "bepinex" and entry.is_dir():
+                return entry.path
     return None
 
 
@@ -183,10 +558,13 @@ def find_bepinex_dir(root):
 # ARCHIVE EXTRACTION
 # ==================================================
 
-def extract_archive(path, temp_dir):
+def extract_archive(path, temp_dir, skip_members=()):
     if path.lower().endswith(".zip"):
         with zipfile.ZipFile(path) as z:
-            z.extractall(temp_dir)
+            members = None
+            if skip_members:
+                members = [n for n in z.namelist() if n not in skip_members]
+            z.extractall(temp_dir, members)
 
     elif path.lower().endswith(".7z"):
         with py7zr.SevenZipFile(path, mode="r") as z:
@@ -201,119 +579,230 @@ def extract_archive(path, temp_dir):
 # CORE SCAN LOGIC
 # ==================================================
 
-def scan_path(path, output_dirs):
-    norm = os.path.normpath(path)
-    if norm.startswith(SORTED_ROOT):
-        return
+def walk_files(path):
+    # Explicit stack instead of recursion: no frame per folder, no depth limit
+    pending = deque([path])
+
+    while pending:
+        folder = pending.pop()
 
-    # ---------------------------
-    # DIRECTORY HANDLING
-    # ---------------------------
-    if os.path.isdir(path):
         try:
-            entries = os.listdir(path)
+            with os.scandir(folder) as it:
+                entries = list(it)
         except Exception:
-            return
+            continue
 
         # Detect BepInEx folder at this level
+        bepinex = next(
+            (e for e in entries if e.name.lower() == "bepinex" and e.is_dir()),
+            None
+        )
+        if bepinex is not None:
+            dest = unique_path(SORTED_ROOT, "BepInEx")
+            shutil.copytree(bepinex.path, dest, copy_function=place_file)
+            add_counts(Count.TotalFiles)
+            continue  # stop scanning this branch
+
+        # DirEntry caches the type, so no extra stat per entry. Walks start
+        # outside SORTED_ROOT, so the only way in is through the folder itself.
+        # Only folders are compared, normalised since a "." root gives "./...".
         for entry in entries:
-            if entry.lower() == "bepinex":
-                src = os.path.join(path, entry)
-                if os.path.isdir(src):
-                    dest = unique_path(SORTED_ROOT, "BepInEx")
-                    shutil.copytree(src, dest)
-                    COUNTS["TotalFiles"] += 1
-                    return  # stop scanning this branch
-
-        # Recurse normally
-        for entry in entries:
-            scan_path(os.path.join(path, entry), output_dirs)
+            if entry.is_dir():
+                if os.path.normpath(entry.path) != SORTED_ROOT:
+                    pending.append(entry.path)
+            else:
+                yield entry
+
+def scan_path(path, output_dirs):
+    # The root may itself be inside SORTED_ROOT; folders below are checked by the walk
+    path = os.path.normpath(path)
+    if path == SORTED_ROOT or path.startswith(SORTED_PREFIX):
         return
 
-    lower = path.lower()
-    filename = os.path.basename(path)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                # The pool starts after the walk's threads are running; forking
+                # then could copy locks those threads hold, so spawn instead
+                mp_context=multiprocessing.get_context("spawn")
+            ) as extractor:
+        scan_tree(path, output_dirs, executor, extractor)
+
+    merge_counts()
+
+# Walks on the calling thread and hands files to the pool. Archives met on the
+# way are extracted once the walk is done, and their temp folders are scanned
+# before this returns.
+def scan_tree(path, output_dirs, executor, extractor):
+    futures = []
+    archives = []
+
+    for entry in walk_files(path):
+        ext = os.path.splitext(entry.name)[1].lower()
+
+        if ext in ARCHIVE_EXTENSIONS:
+            archives.append((entry.path, entry.name))
+        else:
+            handler = FILE_HANDLERS.get(ext, handle_extra)
+            futures.append(
+                executor.submit(handler, entry.path, entry.name, output_dirs)
+            )
 
-    # ---------------------------
-    # ZIPMOD
-    # ---------------------------
-    if lower.endswith(".zipmod"):
-        dest = unique_path(output_dirs["Mod"], filename)
-        shutil.copy2(path, dest)
-        COUNTS["Mod"] += 1
-        COUNTS["TotalFiles"] += 1
-        return
+    scan_archives(archives, output_dirs, executor, extractor)
 
-    # ---------------------------
-    # ARCHIVES (zip / 7z / rar)
-    # ---------------------------
-    if lower.endswith((".zip", ".7z", ".rar")):
-        COUNTS["Archives"] += 1
+    for future in futures:
+        future.result()
 
-        with tempfile.TemporaryDirectory() as tmp:
-            try:
-                extract_archive(path, tmp)
-
-                # Detect BepInEx folder inside archive
-                for entry in os.listdir(tmp):
-                    if entry.lower() == "bepinex":
-                        src = os.path.join(tmp, entry)
-                        if os.path.isdir(src):
-                            dest = unique_path(SORTED_ROOT, "BepInEx")
-                            shutil.copytree(src, dest)
-                            COUNTS["TotalFiles"] += 1
-                            return
-
-                # Pure mod ZIP rule
-                if lower.endswith(".zip") and is_pure_mod_zip(path):
-                    mod_name = os.path.splitext(filename)[0]
-                    dest_dir = unique_path(output_dirs["Mod"], mod_name)
+# Runs in an extractor process. Returns the temp folder and the card type of
+# each zip member left in the archive for streaming; the caller removes the folder.
+def extract_to_temp(path):
+    tmp = tempfile.mkdtemp()
+    try:
+        streamed = set()
+        if path.lower().endswith(".zip"):
+            streamed = streamable_png_members(path)
 
-                    with zipfile.ZipFile(path) as z:
-                        z.extractall(dest_dir)
+        extract_archive(path, tmp, streamed)
+        return tmp, classify_zip_pngs(path, streamed) if streamed else []
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
 
-                    COUNTS["Mod"] += 1
-                    COUNTS["TotalFiles"] += 1
-                    return
+def scan_archives(archives, output_dirs, executor, extractor):
+    archives = iter(archives)
+    pending = {}
 
-                # Normal archive scan
-                scan_path(tmp, output_dirs)
+    try:
+        while True:
+            # Keep every extractor busy without piling up extracted temp folders
+            for path, filename in archives:
+                add_counts(Count.Archives)
+
+                # Pure mod ZIP rule, decided from the central directory alone so
+                # the zip is unpacked once, straight into its mod folder
+                if filename.lower().endswith(".zip") and is_pure_mod_zip(path):
+                    mod_name = os.path.splitext(filename)[0]
+                    dest_dir = unique_path(output_dirs["Mod"], mod_name)
+                    future = extractor.submit(extract_archive, path, dest_dir)
+                else:
+                    dest_dir = None
+                    future = extractor.submit(extract_to_temp, path)
+
+                pending[future] = (path, filename, dest_dir)
+                if len(pending) >= EXTRACT_WORKERS:
+                    break
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, filename, dest_dir = pending.pop(future)
+                if dest_dir is not None:
+                    finish_mod_zip(future, path, filename, dest_dir, output_dirs)
+                else:
+                    scan_archive(future, path, filename, output_dirs, executor, extractor)
+    finally:
+        # Stopped early (Ctrl+C, or placing a result failed): let the
+        # extractions still running finish and remove their temp folders
+        wait(pending)
+        for future, (path, filename, dest_dir) in pending.items():
+            if dest_dir is None and not future.cancelled() and future.exception() is None:
+                shutil.rmtree(future.result()[0], ignore_errors=True)
+
+def finish_mod_zip(extraction, path, filename, dest_dir, output_dirs):
+    try:
+        extraction.result()
+    except Exception:
+        # Don't leave a half-unpacked mod behind next to the copy in Extra
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        dest = unique_path(output_dirs["Extra"], filename)
+        place_file(path, dest)
+        add_counts(Count.Errors)
+        return
 
-            except Exception:
-                dest = unique_path(output_dirs["Extra"], filename)
-                shutil.copy2(path, dest)
-                COUNTS["Errors"] += 1
+    add_counts(Count.Mod, Count.TotalFiles)
 
+def scan_archive(extraction, path, filename, output_dirs, executor, extractor):
+    try:
+        tmp, cards = extraction.result()
+    except Exception:
+        dest = unique_path(output_dirs["Extra"], filename)
+        place_file(path, dest)
+        add_counts(Count.Errors)
         return
 
-    # ---------------------------
-    # PNG CARD
-    # ---------------------------
-    if lower.endswith(".png"):
-        card_type = detect_koikatsu_card_type(path)
-
-        if card_type == "Character":
-            dest_dir = output_dirs["Character"]
-        elif card_type == "Clothing":
-            dest_dir = output_dirs["Clothing"]
-        elif card_type == "Scene":
-            dest_dir = output_dirs["Scene"]
-        else:
-            dest_dir = output_dirs["Extra"]
+    try:
+        # Detect BepInEx folder inside archive
+        with os.scandir(tmp) as it:
+            entries = list(it)
 
-        dest = unique_path(dest_dir, filename)
-        shutil.copy2(path, dest)
+        for entry in entries:
+            if entry.name.lower() == "bepinex" and entry.is_dir():
+                dest = unique_path(SORTED_ROOT, "BepInEx")
+                shutil.copytree(entry.path, dest, copy_function=place_file)
+                add_counts(Count.TotalFiles)
+                return
 
-        COUNTS[card_type] += 1
-        COUNTS["TotalFiles"] += 1
-        return
+        # Normal archive scan. Cards in a zip were classified by the extractor
+        # and are written once, straight from the zip to their destination.
+        if cards:
+            write_zip_cards(path, cards, output_dirs, executor)
+
+        scan_tree(tmp, output_dirs, executor, extractor)
 
-    # ---------------------------
-    # EVERYTHING ELSE
-    # ---------------------------
+    except Exception:
+        dest = unique_path(output_dirs["Extra"], filename)
+        place_file(path, dest)
+        add_counts(Count.Errors)
+
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+# ---------------------------
+# ZIPMOD
+# ---------------------------
+def handle_zipmod(path, filename, output_dirs):
+    dest = unique_path(output_dirs["Mod"], filename)
+    place_file(path, dest)
+    add_counts(Count.Mod, Count.TotalFiles)
+
+# ---------------------------
+# PNG CARD
+# ---------------------------
+def card_folder(card_type, output_dirs):
+    if card_type == "Character":
+        return output_dirs["Character"]
+    elif card_type == "Clothing":
+        return output_dirs["Clothing"]
+    elif card_type == "Scene":
+        return output_dirs["Scene"]
+    else:
+        return output_dirs["Extra"]
+
+def handle_png(path, filename, output_dirs):
+    card_type = detect_koikatsu_card_type(path)
+
+    dest = unique_path(card_folder(card_type, output_dirs), filename)
+    place_file(path, dest)
+
+    add_counts(Count[card_type], Count.TotalFiles)
+
+# ---------------------------
+# EVERYTHING ELSE
+# ---------------------------
+def handle_extra(path, filename, output_dirs):
     dest = unique_path(output_dirs["Extra"], filename)
-    shutil.copy2(path, dest)
-    COUNTS["Extra"] += 1
-    COUNTS["TotalFiles"] += 1
+    place_file(path, dest)
+    add_counts(Count.Extra, Count.TotalFiles)
+
+# Keyed by lowercased extension; anything missing goes to handle_extra
+FILE_HANDLERS = {
+    ".zipmod": handle_zipmod,
+    ".png": handle_png,
+}
+
+ARCHIVE_EXTENSIONS = {".zip", ".7z", ".rar"}
 
 
 # ==================================================
@@ -321,7 +810,17 @@ def scan_path(path, output_dirs):
 # ==================================================
 
 if __name__ == "__main__":
-    source_dir = input("Enter folder to scan: ").strip()
+    parser = argparse.ArgumentParser(description="Sort Koikatsu cards and mods.")
+    parser.add_argument("source_dir", nargs="?", help="folder to scan (asked for if omitted)")
+    parser.add_argument(
+        "--mode",
+        choices=["copy", "link", "move"],
+        default="copy",
+        help="copy files, or hardlink or move them when on the same filesystem"
+    )
+    args = parser.parse_args()
+
+    source_dir = args.source_dir or input("Enter folder to scan: ").strip()
     # base_dir = input("Enter base output directory: ").strip()
     base_dir = source_dir
 
@@ -335,7 +834,9 @@ if __name__ == "__main__":
 
     sorted_root, output_dirs = setup_sorted_folders(base_dir)
     SORTED_ROOT = os.path.normpath(sorted_root)
-    LOG_PATH = create_log_file(sorted_root)
+    SORTED_PREFIX = os.path.join(SORTED_ROOT, "")
+    COPY_MODE = args.mode
+    LOG_FILE = create_log_file(sorted_root)
 
     print("Please wait, files are being scanned...")
 